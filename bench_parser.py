@@ -0,0 +1,129 @@
+#! python3
+# coding: utf-8
+
+import sys, time, json, random, platform, tracemalloc
+from array import array
+
+import stat_parser as sp
+from find_tim import tim_header, tim_body_header
+from parse_mic import mic_group_entry, mic_file_entry, prog_header, c_prog_file
+
+def plain(dat):
+    val = dat.value
+    if isinstance(val, (sp.c_lazy_pack, dict)):
+        return {k: plain(dat[k]) for k in val}
+    elif isinstance(val, list):
+        return [plain(v) for v in val]
+    elif isinstance(val, array):
+        return val.tolist()
+    elif isinstance(val, memoryview):
+        return bytes(val)
+    return val
+
+def first_slice(dat):
+    val = dat.value
+    if isinstance(val, (sp.c_lazy_pack, dict)):
+        return dat[next(iter(val))].value
+    elif isinstance(dat.desc, sp.c_desc_buf):
+        return dat[1: len(dat.desc) - 1].value
+    return dat[1: len(val) - 1]
+
+def bench_cases():
+    return [
+        ('tim_header', tim_header),
+        ('tim_body_header', tim_body_header),
+        ('mic_group_entry', mic_group_entry),
+        ('mic_file_entry', mic_file_entry),
+        ('prog_header', prog_header),
+        ('body_256x256_u8', sp.desc_arr(256, sp.desc_arr(256, sp.desc_ubyte))),
+        ('body_256x256_u16', sp.desc_arr(256,
+                                         sp.desc_tarr(256, sp.desc_uword))),
+        ('codecmd_4096', sp.desc_arr(4096, c_prog_file.codecmd_desc)),
+        ('buf_4096', sp.desc_buf(4096)),
+    ]
+
+def timeit(fn, mintime):
+    n = 1
+    while True:
+        st = time.perf_counter()
+        for _ in range(n):
+            fn()
+        dt = time.perf_counter() - st
+        if dt >= mintime:
+            return n / dt
+        if dt > 0:
+            n = max(n * 2, int(n * mintime / dt))
+        else:
+            n *= 10
+
+def allocs(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        snap1 = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        rs = fn()
+        cur, peak = tracemalloc.get_traced_memory()
+        snap2 = tracemalloc.take_snapshot()
+        del rs
+    finally:
+        tracemalloc.stop()
+    blocks = sum(max(st.count_diff, 0)
+                 for st in snap2.compare_to(snap1, 'lineno'))
+    return {
+        'peak': peak - base,
+        'retained': cur - base,
+        'blocks': blocks,
+    }
+
+def bench_one(name, desc, mintime, seed = 0):
+    rng = random.Random(seed)
+    raw = bytes(rng.getrandbits(8) for _ in range(len(desc)))
+    dat = sp.data_pack(desc, raw)
+    val = plain(dat)
+    ops = {
+        'data_pack': lambda: sp.data_pack(desc, raw),
+        'buffer': lambda: sp.data_pack(desc, raw).buffer(),
+        'slice': lambda: first_slice(sp.data_pack(desc, raw)),
+        'data_update': lambda: sp.data_update(sp.data_pack(desc, raw), val),
+    }
+    rs = {'size': len(desc)}
+    for k, fn in ops.items():
+        rs[k] = {
+            'ops': timeit(fn, mintime),
+            'alloc': allocs(fn),
+        }
+    return rs
+
+def bench(mintime = 0.2, only = None):
+    rs = {
+        'python': platform.python_version(),
+        'mintime': mintime,
+        'cases': {},
+    }
+    for name, desc in bench_cases():
+        if only and not name in only:
+            continue
+        rs['cases'][name] = bench_one(name, desc, mintime)
+    return rs
+
+if __name__ == '__main__':
+
+    mintime = 0.2
+    only = []
+    out_file = None
+    for arg in sys.argv[1:]:
+        if arg.startswith('--time='):
+            mintime = float(arg[7:])
+        elif arg.startswith('--out='):
+            out_file = arg[6:]
+        else:
+            only.append(arg)
+    rs = bench(mintime, only)
+    if out_file:
+        with open(out_file, 'w') as fd:
+            json.dump(rs, fd, indent = 4)
+    else:
+        json.dump(rs, sys.stdout, indent = 4)
+        print()
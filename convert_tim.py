@@ -13,24 +13,34 @@ python -m pip install pillow
 ''')
     raise
 
+import os, sys, io
+import array
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
 import stat_parser as sp
-from find_tim import tim_header, tim_body_header
+from find_tim import tim_header, tim_body_header, pool_workers
+
+nibble_shift = bytes(((i << 4) & 0xf0) for i in range(256))
 
-class c_tim_converter:
+class c_tim_converter(sp.c_reader):
+
+    VERSION = 1
+    pixel16_cache = {}
+    clut_lut_cache = {}
+    clut_lut_limit = 64
+    channel_dist = None
 
     def __init__(self, raw):
-        self.raw = raw
-        self.pos = 0
+        super().__init__(raw)
         self.parse_header()
         self.parse_body_image()
         self.parse_body_clut()
         self.make_image()
 
     def get_datapack(self, desc):
-        epos = self.pos + len(desc)
-        rdat = self.raw[self.pos:epos]
-        dp = sp.data_pack(desc, rdat)
-        self.pos = epos
+        dp = self.pack_at(desc, self.pos, False)
+        self.skip(len(desc))
         return dp
 
     def parse_body_header(self, bofs = False):
@@ -43,7 +53,7 @@ class c_tim_converter:
         elif hlen == 0:
             raise ValueError('empty body')
         body_desc = sp.desc_arr(
-            hh, sp.desc_arr(hw, sp.desc_uword))
+            hh, sp.desc_tarr(hw, sp.desc_uword))
         if bofs:
             offset = self.pos
         bd = self.get_datapack(body_desc)
@@ -63,7 +73,7 @@ class c_tim_converter:
         if self.has_clut:
             if self.bpp == 3:
                 raise ValueError('invalid header type')
-            self.clut = self.parse_body_header()
+            self.clut, self.clut_offset = self.parse_body_header(True)
         self.body, self.body_offset = self.parse_body_header(True)
 
     def parse_body_image(self):
@@ -72,11 +82,11 @@ class c_tim_converter:
         self.height = rows
         if self.bpp in [0, 1]:
             row_desc = sp.desc_pack(
-                ('row', sp.desc_arr(rowlen * 2, sp.desc_ubyte)))
+                ('row', sp.desc_tarr(rowlen * 2, sp.desc_ubyte)))
             self.width = ((rowlen * 4) >> self.bpp)
         elif self.bpp == 2:
             row_desc = sp.desc_pack(
-                ('row', sp.desc_arr(rowlen, sp.desc_uword)))
+                ('row', sp.desc_tarr(rowlen, sp.desc_uword)))
             self.width = rowlen
         elif self.bpp == 3:
             padlen = (rowlen * 2) % 3
@@ -92,17 +102,17 @@ class c_tim_converter:
                                     sp.desc_arr(3, sp.desc_ubyte))),
                 ('pad', pad_desc))
         body_desc = sp.desc_arr(rows, row_desc)
-        self.body = sp.data_pack(body_desc, self.body.buffer())
+        self.body = self.pack_at(body_desc, self.body_offset, False)
 
     def parse_body_clut(self):
         if not self.has_clut:
             return
-        body_desc = sp.desc_arr(int(len(self.clut) / 2), sp.desc_uword)
-        self.clut = sp.data_pack(body_desc, self.clut.buffer())
-        self.clut = [i.value for i in self.clut]
+        body_desc = sp.desc_tarr(int(len(self.clut) / 2), sp.desc_uword)
+        self.clut = self.pack_at(body_desc, self.clut_offset, False).value
         self.clut_rev = {}
         for i in range(len(self.clut) - 1, -1, -1):
             self.clut_rev[self.clut[i]] = i
+        self.lut = None
 
     def get_body_value(self, x, y):
         rx = x
@@ -200,6 +210,80 @@ class c_tim_converter:
             raise ValueError('no match for clut')
         return v
 
+    @classmethod
+    def channel_tables(cls):
+        # one big int per (channel, 5-bit value c): byte k holds
+        # |channel(k) - c| for 15-bit colour k, channel r/g/b at bit 0/5/10
+        if cls.channel_dist is None:
+            cls.channel_dist = [
+                [int.from_bytes(b''.join(
+                    bytes([abs(j - c)]) * (1 << sh) for j in range(32)
+                ) * (0x400 >> sh), 'little') for c in range(32)]
+                for sh in (0, 5, 10)]
+        return cls.channel_dist
+
+    def clut_lut_stp(self, stp):
+        # nearest clut index for all 15-bit colours at once:
+        # every int below packs 0x8000 byte lanes, lane k for colour k
+        n = 0x8000
+        full = int.from_bytes(b'\xff' * n, 'little')
+        ones = int.from_bytes(b'\x01' * n, 'little')
+        hbits = ones << 7
+        chs = self.channel_tables()
+        # 0x7f: above any real distance, lanes stay below bit 7
+        dmin = ones * 0x7f
+        # best index, low and high byte per lane
+        ilo = ihi = 0
+        found = False
+        for i, v in enumerate(self.clut):
+            vrgba = self.get_rgba_by_value(v, 2)
+            if not vrgba[3] == stp:
+                continue
+            found = True
+            # manhattan distance per lane, at most 31 * 3 = 93,
+            # so the sum never carries into the next lane
+            d = (chs[0][vrgba[0] >> 3] +
+                 chs[1][vrgba[1] >> 3] +
+                 chs[2][vrgba[2] >> 3])
+            # (d + 0x80) - dmin per lane is in 1..0xff, no borrow
+            # across lanes; bit 7 stays set iff d >= dmin.
+            # spread it to 0xff to keep the older (lower) index on ties
+            keep = ((((d | hbits) - dmin) & hbits) >> 7) * 0xff
+            take = full ^ keep
+            # select per lane: old where keep, new where take
+            dmin = (dmin & keep) | (d & take)
+            ilo = (ilo & keep) | ((i & 0xff) * ones & take)
+            ihi = (ihi & keep) | ((i >> 8) * ones & take)
+        if not found:
+            return array.array('H', [0xffff]) * n
+        # interleave index bytes into little endian words
+        buf = bytearray(n * 2)
+        buf[0::2] = ilo.to_bytes(n, 'little')
+        buf[1::2] = ihi.to_bytes(n, 'little')
+        lut = array.array('H', buf)
+        if sys.byteorder == 'big':
+            lut.byteswap()
+        return lut
+
+    def clut_lut(self):
+        if not self.lut is None:
+            return self.lut
+        key = hashlib.md5(self.clut.tobytes()).digest()
+        cache = self.clut_lut_cache
+        lut = cache.pop(key, None)
+        if lut is None:
+            lo = self.clut_lut_stp(False)
+            hi = self.clut_lut_stp(True)
+            lut = lo + hi
+            # black flips stp
+            lut[0] = hi[0]
+            lut[0x8000] = lo[0]
+            while len(cache) >= self.clut_lut_limit:
+                cache.pop(next(iter(cache)))
+        cache[key] = lut
+        self.lut = lut
+        return lut
+
     def get_rgba(self, x, y):
         v = self.get_body_value(x, y)
         if self.has_clut:
@@ -207,17 +291,22 @@ class c_tim_converter:
         else:
             return self.get_rgba_by_value(v)
 
-    def set_rgba(self, x, y, rgba):
+    def rgba_value(self, rgba):
         if self.has_clut:
             vi = self.get_value_by_rgba(rgba, 2)
             if vi in self.clut_rev:
                 v = self.clut_rev[vi]
             else:
-                v = self.find_clut_value(rgba)
+                v = self.clut_lut()[vi]
+                if v == 0xffff:
+                    raise ValueError('no match for clut')
                 self.clut_rev[vi] = v
         else:
             v = self.get_value_by_rgba(rgba)
-        self.set_body_value(x, y, v)
+        return v
+
+    def set_rgba(self, x, y, rgba):
+        self.set_body_value(x, y, self.rgba_value(rgba))
 
     def iter_rgba(self):
         for y in range(self.height):
@@ -225,54 +314,200 @@ class c_tim_converter:
                 rgba = self.get_rgba(x, y)
                 yield rgba, x, y
 
-    def make_image(self):
+    @staticmethod
+    def rgba_pixel(rgba):
+        rgb = rgba[:3]
+        if rgba[3]:
+            if rgb == (0, 0, 0):
+                alpha = 0
+            else:
+                alpha = 128
+        else:
+            alpha = 255
+        return (rgb[0], rgb[1], rgb[2], alpha)
+
+    def pixel_table(self):
+        if self.has_clut:
+            return [bytes(self.rgba_pixel(self.get_rgba_by_value(v, 2)))
+                    for v in self.clut]
+        return [bytes(self.rgba_pixel(self.get_rgba_by_value(v)))
+                for v in range(1 << (4 << self.bpp))]
+
+    def image_data(self):
+        rows = [row['row'] for row in self.body.value]
+        if self.bpp == 3:
+            return b''.join(row.buffer() for row in rows)
+        rows = [row.value for row in rows]
+        if self.bpp == 2 and not self.has_clut:
+            vals = set()
+            for row in rows:
+                vals.update(row)
+            ptab = self.pixel16_cache
+            for v in vals.difference(ptab):
+                ptab[v] = bytes(self.rgba_pixel(self.get_rgba_by_value(v)))
+        else:
+            ptab = self.pixel_table()
+            if len(ptab) < (16 if self.bpp == 0 else 256):
+                return None
+            if self.bpp == 0:
+                ptab = [ptab[v & 0xf] + ptab[v >> 4] for v in range(256)]
+        return b''.join(b''.join(map(ptab.__getitem__, row)) for row in rows)
+
+    def make_image_px(self):
         self.image = Image.new(
             mode = 'RGBA', size = (self.width, self.height))
         px = self.image.load()
         for rgba, x, y in self.iter_rgba():
-            rgb = rgba[:3]
-            if rgba[3]:
-                if rgb == (0, 0, 0):
-                    alpha = 0
-                else:
-                    alpha = 128
-            else:
-                alpha = 255
-            px[x, y] = (rgb[0], rgb[1], rgb[2], alpha)
+            px[x, y] = self.rgba_pixel(rgba)
+
+    def make_image(self):
+        data = self.image_data()
+        if data is None:
+            return self.make_image_px()
+        size = (self.width, self.height)
+        if self.bpp == 3:
+            self.image = Image.frombuffer(
+                'RGB', size, data, 'raw', 'RGB', 0, 1).convert('RGBA')
+        else:
+            self.image = Image.frombuffer(
+                'RGBA', size, data, 'raw', 'RGBA', 0, 1)
 
     def import_raw(self):
-        img_dat = self.body.buffer()
-        sofs = self.body_offset
-        eofs = sofs + len(img_dat)
-        self.raw = self.raw[:sofs] + img_dat + self.raw[eofs:]
+        raw = bytearray(self.raw)
+        self.body.pack_into(raw, self.body_offset)
+        self.raw = bytes(raw)
 
-    def import_image(self):
+    @staticmethod
+    def pixel_rgba(pixel):
+        alpha = pixel[3]
+        if alpha > 60:
+            rgb = pixel[:3]
+        else:
+            rgb = (0, 0, 0)
+        stp = (alpha < 128)
+        return (rgb[0], rgb[1], rgb[2], stp)
+
+    def import_image_px(self):
         px = self.image.load()
         for y in range(self.image.height):
             for x in range(self.image.width):
-                rgba = px[x, y]
-                alpha = rgba[3]
-                if alpha > 200:
-                    stp = False
-                    rgb = rgba[:3]
-                elif alpha > 60:
-                    stp = True
-                    rgb = rgba[:3]
-                else:
-                    stp = True
-                    rgb = (0, 0, 0)
-                stp = (rgba[3] < 128)
-                self.set_rgba(x, y,
-                    (rgb[0], rgb[1], rgb[2], stp))
+                self.set_rgba(x, y, self.pixel_rgba(px[x, y]))
         self.import_raw()
 
+    def body_data(self):
+        if not (self.image.mode == 'RGBA' and
+                self.image.size == (self.width, self.height)):
+            return None
+        pixels = memoryview(self.image.tobytes()).cast('I')
+        vtab = {}
+        for pv in dict.fromkeys(pixels):
+            vtab[pv] = self.rgba_value(
+                self.pixel_rgba(pv.to_bytes(4, sys.byteorder)))
+        if self.bpp == 0:
+            lo = bytes(map(lambda pv: vtab[pv] & 0xf, pixels[0::2]))
+            hi = bytes(map(lambda pv: vtab[pv] & 0xf, pixels[1::2]))
+            hi = hi.translate(nibble_shift)
+            return (int.from_bytes(lo, 'little') |
+                    int.from_bytes(hi, 'little')).to_bytes(len(lo), 'little')
+        elif self.bpp == 1:
+            return bytes(map(lambda pv: vtab[pv] & 0xff, pixels))
+        elif self.bpp == 2:
+            vals = array.array('H', map(vtab.__getitem__, pixels))
+            return sp.desc_tarr(len(vals), sp.desc_uword).buffer(vals)
+        vtab = {pv: bytes(v[:3]) for pv, v in vtab.items()}
+        rgb = b''.join(map(vtab.__getitem__, pixels))
+        return [rgb[i: i + self.width * 3]
+                for i in range(0, len(rgb), self.width * 3)]
+
+    def import_image(self):
+        data = self.body_data()
+        if data is None:
+            return self.import_image_px()
+        raw = bytearray(self.raw[:])
+        if self.bpp == 3:
+            stride = len(self.body.desc.subdesc)
+            for y, row in enumerate(data):
+                ofs = self.body_offset + y * stride
+                raw[ofs: ofs + len(row)] = row
+        else:
+            raw[self.body_offset: self.body_offset + len(data)] = data
+        self.raw = bytes(raw)
+        self.body = self.pack_at(self.body.desc, self.body_offset, False)
+
     def save_png(self, png_fn):
         self.image.save(png_fn, 'png')
 
     def load_png(self, png_fn):
         self.image = Image.open(png_fn).convert('RGBA')
         self.import_image()
-    
+
+def load_tim(tim_fn):
+    try:
+        with open(tim_fn, 'rb') as fd:
+            return c_tim_converter(fd.read())
+    except ValueError as e:
+        if e.args[0] == 'empty body':
+            return None
+        raise
+
+def png_worker(args):
+    tag, tim_fn = args
+    tc = load_tim(tim_fn)
+    if not tc:
+        return tag, None
+    buf = io.BytesIO()
+    tc.save_png(buf)
+    return tag, buf.getvalue()
+
+def tim_worker(args):
+    tag, tim_fn, png_fn = args
+    tc = load_tim(tim_fn)
+    if not tc:
+        return tag, None
+    tc.load_png(png_fn)
+    return tag, tc.raw
+
+def file_hash(fn):
+    with open(fn, 'rb') as fd:
+        return hashlib.md5(fd.read()).hexdigest()
+
+class c_conv_cache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, tim_fn, png_fn):
+        return hashlib.md5('{}:{}:{}'.format(
+            c_tim_converter.VERSION,
+            file_hash(tim_fn), file_hash(png_fn)).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.tim')
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as fd:
+                return fd.read()
+        except OSError:
+            return None
+
+    def put(self, key, raw):
+        tmp_fn = self.path(key) + '.tmp'
+        with open(tmp_fn, 'wb') as fd:
+            fd.write(raw)
+        os.replace(tmp_fn, self.path(key))
+
+def convert_batch(worker, jobs, workers = 0):
+    workers = min(pool_workers(workers), len(jobs))
+    if workers <= 1:
+        yield from map(worker, jobs)
+        return
+    chunk = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(workers) as ex:
+        yield from ex.map(worker, jobs, chunksize = chunk)
+
 if __name__ == '__main__':
 
     tim_file = r'table\ext\tim\005aa270_000049c4.tim'
@@ -2,6 +2,7 @@
 # coding: utf-8
 
 from mod_charset import c_psbios_sj_mapper, is_ascii
+import monitor as mn
 
 shift_jis_mapper = c_psbios_sj_mapper()
 
@@ -143,10 +144,11 @@ EOS = 0 #b'\00'
 class c_text_finder:
 
     def __init__(self, raw, offset = 0,
-                 checker = valid_shift_jis_text):
+                 checker = valid_shift_jis_text, monitor = None):
         self.raw = raw
         self.pos = offset
         self.checker = checker
+        self.mon = monitor if monitor else mn.c_monitor()
         self.text_list = []
 
     def goto_next_string(self):
@@ -174,6 +176,7 @@ class c_text_finder:
         start_pos, end_pos, next_pos = self.get_string_info()
         if start_pos is None:
             return False
+        self.mon.count('text_bytes', next_pos - start_pos)
         src_s = self.raw[start_pos:end_pos]
         dst_s, trim_pos = self.checker(src_s)
         if dst_s:
@@ -183,7 +186,8 @@ class c_text_finder:
                 'info': (start_pos, end_pos - start_pos, next_pos - end_pos),
                 'trans': '',
             })
-            print('txt:', dst_s)
+            self.mon.event('text')
+            self.mon.log(mn.VERBOSE, 'txt:', dst_s)
         return True
 
     def scan(self):
@@ -4,8 +4,15 @@
 import os, os.path
 import math
 import json
+import bisect
+import hashlib
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED)
 
 import stat_parser as sp
+import monitor as mn
 
 tim_header = sp.desc_pack(
     ('magic', sp.desc_uint),
@@ -22,17 +29,140 @@ tim_body_header = sp.desc_pack(
 
 unknown_uint = sp.desc_uint
 
-class c_tim_scanner:
+scan_index_magic = b'TIMI'
+
+scan_index_header = sp.desc_pack(
+    ('magic', sp.desc_buf(4)),
+    ('version', sp.desc_uint),
+    ('offset', sp.desc_uint),
+    ('sector_size', sp.desc_uint),
+    ('region_size', sp.desc_uint),
+    ('tim_num', sp.desc_uint),
+    ('uk_num', sp.desc_uint),
+    ('region_num', sp.desc_uint),
+    ('end', sp.desc_uint),
+)
+
+def scan_files_desc(num, has_done = False, has_hash = False):
+    items = [
+        ('offset', sp.desc_tarr(num, sp.desc_uint)),
+        ('size', sp.desc_tarr(num, sp.desc_uint)),
+        ('ukint', sp.desc_tarr(num, sp.desc_ulong)),
+        ('ukwidth', sp.desc_tarr(num, sp.desc_ubyte)),
+    ]
+    if has_done:
+        items.append(('done', sp.desc_tarr(num, sp.desc_ubyte)))
+    if has_hash:
+        items.append(('hash', sp.desc_buf(num * 16)))
+    return sp.desc_pack(*items)
+
+def scan_marks_desc(num):
+    return sp.desc_pack(
+        ('pos', sp.desc_tarr(num, sp.desc_uint)),
+        ('open', sp.desc_tarr(num, sp.desc_ubyte)),
+        ('osize', sp.desc_tarr(num, sp.desc_uint)),
+        ('ntim', sp.desc_tarr(num, sp.desc_uint)),
+        ('nuk', sp.desc_tarr(num, sp.desc_uint)),
+    )
+
+def scan_index_desc(ntim, nuk, nreg):
+    return sp.desc_pack(
+        ('tim', scan_files_desc(ntim, has_hash = True)),
+        ('unknown', scan_files_desc(nuk, True)),
+        ('marks', scan_marks_desc(nreg + 1)),
+        ('hashes', sp.desc_buf(nreg * 16)),
+    )
+
+class c_scan_files(Sequence):
+
+    def __init__(self, cols):
+        self.cols = cols
+
+    @staticmethod
+    def from_list(flist, has_done = False, has_hash = False):
+        if isinstance(flist, c_scan_files):
+            return flist
+        cols = {
+            'offset': array('I', (fi['offset'] for fi in flist)),
+            'size': array('I', (fi['size'] for fi in flist)),
+            'ukint': array('Q', (int(fi['ukint'], 16) for fi in flist)),
+            'ukwidth': array('B', (len(fi['ukint']) for fi in flist)),
+        }
+        if has_done:
+            cols['done'] = array('B', (fi['done'] for fi in flist))
+        if has_hash:
+            cols['hash'] = bytes.fromhex(''.join(fi['hash'] for fi in flist))
+        return c_scan_files(cols)
+
+    def __len__(self):
+        return len(self.cols['offset'])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        cols = self.cols
+        fi = {
+            'ukint': ('{:0' + str(cols['ukwidth'][idx]) + 'x}').format(
+                cols['ukint'][idx]),
+            'offset': cols['offset'][idx],
+            'size': cols['size'][idx],
+        }
+        if 'done' in cols:
+            fi['done'] = bool(cols['done'][idx])
+        if 'hash' in cols:
+            fi['hash'] = bytes(cols['hash'][idx * 16: idx * 16 + 16]).hex()
+        return fi
+
+    def find(self, offset):
+        offs = self.cols['offset']
+        idx = bisect.bisect_left(offs, offset)
+        if idx < len(offs) and offs[idx] == offset:
+            return self[idx]
+        return None
+
+# ProcessPoolExecutor refuses more on windows
+max_pool_workers = 61
+
+def pool_workers(workers):
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+    return min(workers, max_pool_workers)
+
+part_raw = None
+
+def init_part_worker(src):
+    global part_raw
+    if isinstance(src, str):
+        src = sp.map_file(src, False)
+    part_raw = src
+
+def scan_part_worker(args):
+    st, ed, base_sect, sector_size = args
+    scanner = c_tim_scanner(part_raw, st, base_sect, sector_size,
+                            mn.silent_monitor)
+    marks, ended = scanner.scan_part(ed)
+    return marks, ended, scanner.tim_files, scanner.unknown_files
+
+class c_tim_scanner(sp.c_reader):
 
     
     TIM_MAGIC = b'\x10\x00\x00\x00'
+    VERSION = 2
 
     def __init__(self, raw, offset = 0,
-                 base_sect = 0, sector_size = 2048):
-        self.raw = raw
-        self.pos = offset
+                 base_sect = 0, sector_size = 2048, monitor = None):
+        super().__init__(raw, offset)
+        self.mon = monitor if monitor else mn.c_monitor()
         self.base_sect = base_sect
         self.sector_size = sector_size
+        self.region_size = sector_size * 0x40
+        self.scan_offset = offset
+        self.scan_marks = []
+        self.scan_end = 0
+        self.scan_done = False
+        self.scan_pending = None
         self.tim_files = []
         self.unknown_files = []
 
@@ -59,47 +189,43 @@ class c_tim_scanner:
                 fval != 10 and fval != 11 and fval != 12)
 
     def goto_next_sector(self):
-        self.pos = (
-            math.floor(self.pos / self.sector_size) + 1) * self.sector_size
-
-    def get_pack(self, desc, noshift = False):
-        if self.pos >= len(self.raw):
-            return None
-        spos = self.pos
-        dpos = spos + len(desc)
-        if not noshift:
-            self.pos = dpos
-        #print('->', hex(spos))
-        return sp.data_pack(desc,
-                            self.raw[spos:dpos])
+        self.seek((
+            math.floor(self.pos / self.sector_size) + 1) * self.sector_size)
 
     def find_next_tim(self):
-        while self.pos <= len(self.raw) - len(tim_header):
-            head = self.get_pack(tim_header, True)
-            if head['magic'].value == 0x10:
-                if self.valid_flags(head['flags'].value):
-                    self.pos -= 4
-                    print('tim found', hex(self.pos))
-                    return True
-            self.pos += 2
-        else:
-            self.pos = len(self.raw)
-            print('done')
-            return False
+        rlen = len(self.raw)
+        hlen = len(tim_header)
+        while self.pos <= rlen - hlen:
+            hit = self.find(self.TIM_MAGIC, self.pos, rlen - hlen + 4)
+            if hit < 0:
+                break
+            elif (hit - self.pos) % 2:
+                self.seek(hit + 1)
+                continue
+            self.seek(hit)
+            head = self.peek_pack(tim_header)
+            if self.valid_flags(head['flags'].value):
+                self.skip(-4)
+                self.mon.log(mn.VERBOSE, 'tim found', hex(self.pos))
+                return True
+            self.skip(2)
+        self.seek(rlen)
+        self.mon.log(mn.VERBOSE, 'done')
+        return False
 
     def scan_body(self):
-        head = self.get_pack(tim_body_header)
+        head = self.read_pack(tim_body_header)
         if not head:
             return 0
         if not head['length'].value - 12 == (
             head['width'].value * head['height'].value * 2):
-            print('invalid body:',
+            self.mon.log(mn.VERBOSE, 'invalid body:',
                   head['length'].value - 12,
                   head['width'].value,
                   head['height'].value,
                   head['width'].value * head['height'].value * 2)
             return 0
-        self.pos += head['length'].value - len(head)
+        self.skip(head['length'].value - len(head))
         return head['length'].value
 
     def repr_ukint(self, ukint):
@@ -123,91 +249,298 @@ class c_tim_scanner:
                 'done': False,
             }
             self.unknown_files.append(ukfile)
-        self.pos = start_pos + 2
+            self.mon.event('unknown')
+        self.seek(start_pos + 2)
         found = self.find_next_tim()
         ukfile['size'] = self.pos - ukfile['offset']
-        print('file:', hex(ukfile['offset']), hex(ukfile['size']))
+        self.mon.log(mn.VERBOSE,
+                     'file:', hex(ukfile['offset']), hex(ukfile['size']))
         return found
 
-    def scan_next(self, last_ukint = None):
-        if last_ukint:
-            ukint = last_ukint
-        else:
-            ukint = self.get_pack(unknown_uint)
-        if not ukint:
-            print('done')
-            return False
-        print('===', self.repr_ukint(ukint), '===')
-        print('scan:', hex(self.pos), 'in sect', self.sector_num(self.pos))
-        start_pos = self.pos
-        head = self.get_pack(tim_header)
-        if not head:
-            print('done')
-            return False
-        if head['magic'].value == 0xffffffff:
-            print('sector done')
-            self.goto_next_sector()
-            return True
-        elif (head['magic'].value != 0x10 or
-              not self.valid_flags(head['flags'].value)):
-            retry_for_uki = True
-            if not last_ukint is None:
-                retry_for_uki = False
-            elif ukint.value == 0x10:
-                self.pos -= 4 + len(head)
-                pad_ukint = self.get_pack(sp.desc_void)
-            elif ukint.value == 0x100000:
-                self.pos -= 4 + len(head)
-                pad_ukint = self.get_pack(sp.desc_uword)
-            elif (head['magic'].value >> 16) == 0x10:
-                self.pos -= 4+ len(head)
-                pad_ukint = self.get_pack(sp.desc_arr(3, sp.desc_uword))
-            else:
-                retry_for_uki = False
-            if retry_for_uki:
-                print('retry for no ukint')
-                return self.scan_next(pad_ukint)
+    def scan_next(self):
+        verbose = self.mon.enabled(mn.VERBOSE)
+        last_ukint = None
+        while True:
             if last_ukint:
-                self.pos -= len(head)
-                return self.scan_next(False)
-            print('unknown header: ', end = '')
-            print(head['magic'].buffer())
-            found = self.find_next(start_pos, ukint)
-            if not found:
-                return False
+                ukint = last_ukint
             else:
+                ukint = self.read_pack(unknown_uint)
+            if not ukint:
+                self.mon.log(mn.VERBOSE, 'done')
+                return False
+            if verbose:
+                self.mon.log(mn.VERBOSE,
+                             '===', self.repr_ukint(ukint), '===')
+                self.mon.log(mn.VERBOSE, 'scan:', hex(self.pos),
+                             'in sect', self.sector_num(self.pos))
+            start_pos = self.pos
+            head = self.read_pack(tim_header)
+            if not head:
+                self.mon.log(mn.VERBOSE, 'done')
+                return False
+            if head['magic'].value == 0xffffffff:
+                self.mon.log(mn.VERBOSE, 'sector done')
+                self.goto_next_sector()
                 return True
-        else:
-            print('tim', head['flags'].value)
+            elif (head['magic'].value != 0x10 or
+                  not self.valid_flags(head['flags'].value)):
+                pad_desc = None
+                if not last_ukint is None:
+                    pass
+                elif ukint.value == 0x10:
+                    pad_desc = sp.desc_void
+                elif ukint.value == 0x100000:
+                    pad_desc = sp.desc_uword
+                elif (head['magic'].value >> 16) == 0x10:
+                    pad_desc = sp.desc_arr(3, sp.desc_uword)
+                if not pad_desc is None:
+                    self.skip(-4 - len(head))
+                    last_ukint = self.read_pack(pad_desc)
+                    self.mon.log(mn.VERBOSE, 'retry for no ukint')
+                    continue
+                if last_ukint:
+                    self.skip(-len(head))
+                    last_ukint = False
+                    continue
+                if verbose:
+                    self.mon.log(mn.VERBOSE, 'unknown header: ' +
+                                 str(head['magic'].buffer()))
+                return self.find_next(start_pos, ukint)
+            break
+        if verbose:
+            self.mon.log(mn.VERBOSE, 'tim', head['flags'].value)
         has_clut = (head['flags'].value & 8)
         if has_clut:
             blen = self.scan_body()
             if not blen:
-                found = self.find_next(start_pos, ukint)
-                if not found:
-                    return False
-                else:
-                    return True
-            print('  clut:', hex(blen))
+                return self.find_next(start_pos, ukint)
+            self.mon.log(mn.VERBOSE, '  clut:', hex(blen))
         blen = self.scan_body()
         if not blen:
-            found = self.find_next(start_pos, ukint)
-            if not found:
-                return False
-            else:
-                return True
-        print('  body:', hex(blen))
+            return self.find_next(start_pos, ukint)
+        self.mon.log(mn.VERBOSE, '  body:', hex(blen))
         self.tim_files.append({
             'ukint': self.repr_ukint(ukint),
             'offset': start_pos,
             'size': self.pos - start_pos,
+            'hash': hashlib.md5(self.raw[start_pos:self.pos]).hexdigest(),
         })
         if len(self.unknown_files) > 0:
             self.unknown_files[-1]['done'] = True
+        self.mon.event('tim')
         return True
 
-    def scan(self):
-        while self.scan_next():
+    def scan_finished(self, ntim, nuk, final = False):
+        enuk = len(self.unknown_files)
+        if not final and self.scan_open():
+            enuk -= 1
+        rs = [('tim', fi) for fi in self.tim_files[ntim:]]
+        rs.extend(('uk', fi) for fi in self.unknown_files[nuk:enuk])
+        rs.sort(key = lambda r: r[1]['offset'])
+        return rs, len(self.tim_files), max(nuk, enuk)
+
+    def iter_scan(self):
+        ntim = len(self.tim_files)
+        nuk = len(self.unknown_files)
+        self.track_start()
+        while True:
+            self.track_mark()
+            going = self.scan_next()
+            self.mon.progress('scan_bytes', self.pos, len(self.raw),
+                              not going, 'MB', 0x100000)
+            rs, ntim, nuk = self.scan_finished(ntim, nuk, not going)
+            yield from rs
+            if not going:
+                break
+        self.track_end()
+
+    def iter_files(self):
+        if not self.scan_done:
+            yield from self.iter_scan()
+            return
+        for fi in self.tim_files:
+            yield 'tim', fi
+        for fi in self.unknown_files:
+            yield 'uk', fi
+
+    def scan_open(self):
+        return (len(self.unknown_files) > 0 and
+                not self.unknown_files[-1]['done'])
+
+    def scan_mark(self):
+        if self.scan_open():
+            osize = self.unknown_files[-1]['size']
+        else:
+            osize = 0
+        return (self.pos, self.scan_open(), osize,
+                len(self.tim_files), len(self.unknown_files))
+
+    def scan_part(self, end):
+        marks = []
+        while self.pos < end:
+            marks.append(self.scan_mark())
+            if not self.scan_next():
+                marks.append(self.scan_mark())
+                return marks, True
+        marks.append(self.scan_mark())
+        return marks, False
+
+    def region_num(self):
+        return math.ceil(len(self.raw) / self.region_size)
+
+    def region_hashes(self):
+        rsize = self.region_size
+        rlen = len(self.raw)
+        try:
+            buf = memoryview(self.raw)
+        except TypeError:
+            buf = self.raw
+        try:
+            return [hashlib.md5(buf[st: st + rsize]).hexdigest()
+                    for st in range(0, rlen, rsize)]
+        finally:
+            if isinstance(buf, memoryview):
+                buf.release()
+
+    def track_start(self):
+        self.scan_marks = []
+        self.scan_end = 0
+
+    def track_mark(self):
+        rsize = self.region_size
+        nreg = self.region_num()
+        while (len(self.scan_marks) < nreg and
+               len(self.scan_marks) * rsize <= self.pos):
+            self.scan_marks.append(self.scan_mark())
+
+    def track_end(self):
+        self.scan_done = True
+        self.scan_end = len(self.scan_marks)
+        mk = self.scan_mark()
+        while len(self.scan_marks) <= self.region_num():
+            self.scan_marks.append(mk)
+
+    def track_next(self, marks, idx):
+        nst = len(self.scan_marks) * self.region_size
+        for i in range(idx + 1, len(marks)):
+            if marks[i][0] >= nst:
+                return i
+        return len(marks) - 1
+
+    def splice_scan(self, tim_files, unknown_files, ma, mb):
+        pos, is_open, osize, ntim, nuk = ma
+        epos, eopen, eosize, entim, enuk = mb
+        self.tim_files.extend(dict(fi) for fi in tim_files[ntim:entim])
+        if is_open:
+            wf = unknown_files[nuk - 1]
+            uf = self.unknown_files[-1]
+            if eopen and enuk == nuk:
+                uf['size'] = wf['offset'] + eosize - uf['offset']
+            else:
+                uf['size'] = wf['offset'] + wf['size'] - uf['offset']
+                uf['done'] = True
+        self.unknown_files.extend(dict(fi) for fi in unknown_files[nuk:enuk])
+        if eopen and enuk > nuk:
+            uf = self.unknown_files[-1]
+            uf['size'] = eosize
+            uf['done'] = False
+        self.pos = epos
+
+    def split_parts(self, workers):
+        rlen = len(self.raw)
+        nsect = math.ceil((rlen - self.pos) / self.sector_size)
+        psect = max(1, math.ceil(nsect / (workers * 4)))
+        psize = psect * self.sector_size
+        bounds = [self.pos]
+        ofs = (math.floor(self.pos / psize) + 1) * psize
+        while ofs < rlen:
+            bounds.append(ofs)
+            ofs += psize
+        bounds.append(rlen)
+        return bounds
+
+    def scan_parallel(self, workers, src = None):
+        workers = pool_workers(workers)
+        bounds = self.split_parts(workers)
+        if len(bounds) < 3:
+            return self.scan()
+        if src is None:
+            src = bytes(self.raw[:])
+        args = [(bounds[i], bounds[i + 1], self.base_sect, self.sector_size)
+                for i in range(len(bounds) - 1)]
+        self.mon.log(mn.INFO,
+                     'scan in', len(args), 'parts with', workers, 'workers')
+        with ProcessPoolExecutor(
+            workers, initializer = init_part_worker,
+            initargs = (src,)) as ex:
+            parts = list(ex.map(scan_part_worker, args))
+        part_marks = [
+            {m[:2]: i for i, m in enumerate(part[0][:-1])} for part in parts]
+        synced = 0
+        self.track_start()
+        while True:
+            self.track_mark()
+            self.mon.progress('scan_bytes', self.pos, len(self.raw),
+                              unit = 'MB', scale = 0x100000)
+            idx = None
+            if self.pos < bounds[-1]:
+                pidx = bisect.bisect_right(bounds, self.pos) - 1
+                idx = part_marks[pidx].get((self.pos, self.scan_open()))
+            if idx is None:
+                if not self.scan_next():
+                    break
+                continue
+            synced += 1
+            marks, ended, tim_files, unknown_files = parts[pidx]
+            jdx = self.track_next(marks, idx)
+            self.splice_scan(tim_files, unknown_files, marks[idx], marks[jdx])
+            if ended and jdx == len(marks) - 1:
+                break
+        self.track_end()
+        self.mon.progress('scan_bytes', self.pos, len(self.raw),
+                          True, 'MB', 0x100000)
+        self.mon.log(mn.INFO, 'scan merged', synced, 'parts')
+
+    def rescan(self, rs, changed):
+        marks = rs['marks']
+        end = rs['end']
+        rsize = self.region_size
+        mark_idx = {(m[0], m[1]): i for i, m in enumerate(marks[:end])}
+        def clean(st, ed):
+            for r in range(st // rsize,
+                           (min(ed, len(self.raw)) - 1) // rsize + 1):
+                if r >= len(changed) or changed[r]:
+                    return False
+            return True
+        self.tim_files = []
+        self.unknown_files = []
+        self.pos = rs['offset']
+        self.track_start()
+        while True:
+            self.track_mark()
+            self.mon.progress('scan_bytes', self.pos, len(self.raw),
+                              unit = 'MB', scale = 0x100000)
+            idx = mark_idx.get((self.pos, self.scan_open()))
+            if not idx is None:
+                if idx + 1 < end:
+                    ed = marks[idx + 1][0] + 16
+                else:
+                    ed = math.inf
+                if clean(marks[idx][0], ed):
+                    self.splice_scan(rs['tim'], rs['unknown'],
+                                     marks[idx], marks[idx + 1])
+                    if idx + 1 >= end:
+                        break
+                    continue
+            if not self.scan_next():
+                break
+        self.track_end()
+
+    def scan(self, workers = 1, src = None):
+        workers = pool_workers(workers)
+        if workers > 1:
+            return self.scan_parallel(workers, src)
+        for _ in self.iter_scan():
             pass
 
     def show_files(self, flist):
@@ -227,100 +560,286 @@ class c_tim_scanner:
 
     def iter_ukraw(self):
         tag_patt = '{:08x}_{:s}'
-        for fi in self.unknown_files:
+        for typ, fi in self.iter_files():
+            if typ != 'uk':
+                continue
             tag = tag_patt.format(fi['offset'], fi['ukint'])
             yield self.raw[fi['offset']:fi['offset']+fi['size']], tag
 
-    def save_scan(self, sav_fn):
-        with open(sav_fn, 'w') as fd:
-            json.dump({
-                'tim': self.tim_files,
-                'unknown': self.unknown_files,
-            }, fd)
+    def save_scan(self, sav_fn, hashes = None):
+        if hashes is None:
+            hashes = self.region_hashes()
+        tim_files = c_scan_files.from_list(self.tim_files, has_hash = True)
+        unknown_files = c_scan_files.from_list(self.unknown_files, True)
+        marks = self.scan_marks
+        head = sp.data_pack(scan_index_header)
+        sp.data_update(head, {
+            'magic': scan_index_magic,
+            'version': self.VERSION,
+            'offset': self.scan_offset,
+            'sector_size': self.sector_size,
+            'region_size': self.region_size,
+            'tim_num': len(tim_files),
+            'uk_num': len(unknown_files),
+            'region_num': len(hashes),
+            'end': self.scan_end,
+        })
+        body = sp.data_pack(scan_index_desc(
+            len(tim_files), len(unknown_files), len(hashes)))
+        sp.data_update(body, {
+            'tim': tim_files.cols,
+            'unknown': unknown_files.cols,
+            'marks': {
+                k: array(tc, (m[i] for m in marks)) for i, (k, tc) in
+                enumerate(zip(('pos', 'open', 'osize', 'ntim', 'nuk'), 'IBIII'))
+            },
+            'hashes': bytes.fromhex(''.join(hashes)),
+        })
+        with open(sav_fn, 'wb') as fd:
+            fd.write(head.buffer())
+            fd.write(body.buffer())
+
+    def load_index(self, sav_fn):
+        with open(sav_fn, 'rb') as fd:
+            raw = fd.read()
+        head = sp.data_view(scan_index_header, raw, 0, True)
+        if head['magic'].value != scan_index_magic:
+            raise ValueError('invalid scan index')
+        nreg = head['region_num'].value
+        if head['version'].value != self.VERSION:
+            return {'version': head['version'].value}
+        body = sp.data_view(scan_index_desc(
+            head['tim_num'].value, head['uk_num'].value, nreg),
+            raw, len(scan_index_header), True)
+        buf = memoryview(raw)
+        def cols(tab):
+            rs = {}
+            for k, desc, pos in tab.desc.fields():
+                ofs = tab.offset + pos
+                col = buf[ofs: ofs + len(desc)]
+                if isinstance(desc, sp.c_desc_tarr):
+                    if desc.swapped:
+                        col = desc.toarray(col)
+                    else:
+                        col = col.cast(desc.typecode)
+                rs[k] = col
+            return rs
+        marks = cols(body['marks'])
+        hashes = body['hashes'].value
+        return {
+            'version': head['version'].value,
+            'offset': head['offset'].value,
+            'sector_size': head['sector_size'].value,
+            'region_size': head['region_size'].value,
+            'end': head['end'].value,
+            'hashes': [bytes(hashes[i: i + 16]).hex()
+                       for i in range(0, nreg * 16, 16)],
+            'marks': list(zip(marks['pos'], map(bool, marks['open']),
+                              marks['osize'], marks['ntim'], marks['nuk'])),
+            'tim': c_scan_files(cols(body['tim'])),
+            'unknown': c_scan_files(cols(body['unknown'])),
+        }
+
+    def valid_scan(self, rs):
+        try:
+            return (rs['version'] == self.VERSION and
+                    rs['offset'] == self.scan_offset and
+                    rs['sector_size'] == self.sector_size and
+                    rs['region_size'] == self.region_size and
+                    len(rs['marks']) == len(rs['hashes']) + 1)
+        except:
+            return False
 
-    def load_scan(self, sav_fn):
+    def load_scan(self, sav_fn, workers = 1, src = None, stream = False):
         try:
-            with open(sav_fn, 'r') as fd:
-                rs = json.load(fd)
+            rs = self.load_index(sav_fn)
+        except:
+            rs = None
+        hashes = self.region_hashes()
+        if rs is None or not self.valid_scan(rs):
+            if not rs is None:
+                self.mon.log(mn.INFO, 'scan cache outdated, rescan all')
+            if stream:
+                # scan while iter_files is consumed, saved by finish_scan
+                self.scan_pending = (sav_fn, hashes, workers, src)
+                return
+            self.scan(workers, src)
+        else:
+            nreg = max(len(hashes), len(rs['hashes']))
+            changed = [
+                r >= len(hashes) or r >= len(rs['hashes']) or
+                hashes[r] != rs['hashes'][r] for r in range(nreg)]
+            if not any(changed):
                 self.tim_files = rs['tim']
                 self.unknown_files = rs['unknown']
+                self.scan_marks = rs['marks']
+                self.scan_end = rs['end']
+                self.scan_done = True
+                return
+            self.mon.log(mn.INFO, 'rescan', sum(changed), 'changed regions')
+            self.rescan(rs, changed)
+        self.save_scan(sav_fn, hashes)
+
+    def finish_scan(self):
+        if self.scan_pending is None:
+            return
+        sav_fn, hashes, workers, src = self.scan_pending
+        if not self.scan_done:
+            if self.scan_marks:
+                for _ in self.iter_scan():
+                    pass
+            else:
+                self.scan(workers, src)
+        self.scan_pending = None
+        self.save_scan(sav_fn, hashes)
+
+    export_manifest = 'manifest.json'
+
+    def load_manifest(self, ext_dir):
+        try:
+            with open(os.path.join(ext_dir, self.export_manifest), 'r') as fd:
+                return json.load(fd)
         except:
-            self.scan()
-            self.save_scan(sav_fn)
+            return {}
+
+    def save_manifest(self, ext_dir, manifest):
+        with open(os.path.join(ext_dir, self.export_manifest), 'w') as fd:
+            json.dump(manifest, fd)
 
-    def save_files(self, ext_dir, force = False, target = []):
+    def write_file(self, fn, fi):
+        with open(fn, 'wb') as fd:
+            fd.write(self.raw[fi['offset']:fi['offset']+fi['size']])
+
+    def save_files(self, ext_dir, force = False, target = [], workers = 8):
         if not os.path.exists(ext_dir):
             os.makedirs(ext_dir)
         fn_patt = '{:08x}_{:s}.{:s}'
         saved = False
-        if not target or 'tim' in target:
-            saving_dialog = 'saving tim filse ...'
-            for fi in self.tim_files:
-                fn = os.path.join(
-                    ext_dir, fn_patt.format(fi['offset'], fi['ukint'], 'tim'))
-                if not force and os.path.exists(fn):
+        dialogs = {
+            'tim': 'saving tim filse ...',
+            'uk': 'saving unknown filse ...',
+        }
+        targets = {'tim': 'tim', 'uk': 'ext'}
+        manifest = self.load_manifest(ext_dir)
+        exported = set(os.listdir(ext_dir))
+        ex = None
+        if workers > 1:
+            ex = ThreadPoolExecutor(workers)
+        pending = set()
+        hashes = set()
+        try:
+            for typ, fi in self.iter_files():
+                if target and not targets[typ] in target:
                     continue
-                if saving_dialog:
-                    print(saving_dialog)
-                    saving_dialog = None
-                    saved = True
-                with open(fn, 'wb') as fd:
-                    fd.write(self.raw[fi['offset']:fi['offset']+fi['size']])
-        if not target or 'ext' in target:
-            saving_dialog = 'saving unknown filse ...'
-            for fi in self.unknown_files:
-                fn = os.path.join(
-                    ext_dir, fn_patt.format(fi['offset'], fi['ukint'], 'uk'))
-                if not force and os.path.exists(fn):
+                if 'hash' in fi:
+                    if fi['hash'] in hashes:
+                        continue
+                    hashes.add(fi['hash'])
+                name = fn_patt.format(fi['offset'], fi['ukint'], typ)
+                if (not force and name in exported and
+                    manifest.get(name, fi['size']) == fi['size']):
                     continue
-                if saving_dialog:
-                    print(saving_dialog)
-                    saving_dialog = None
+                if typ in dialogs:
+                    self.mon.log(mn.INFO, dialogs.pop(typ))
                     saved = True
-                with open(fn, 'wb') as fd:
-                    fd.write(self.raw[fi['offset']:fi['offset']+fi['size']])
+                fn = os.path.join(ext_dir, name)
+                manifest[name] = fi['size']
+                if ex is None:
+                    self.write_file(fn, fi)
+                    continue
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                    for ft in done:
+                        ft.result()
+                pending.add(ex.submit(self.write_file, fn, fi))
+            for ft in pending:
+                ft.result()
+        finally:
+            if ex:
+                ex.shutdown()
         if saved:
-            print('done')
+            self.save_manifest(ext_dir, manifest)
+            self.mon.log(mn.INFO, 'done')
 
-    def import_file(self, fname, raw):
+    def tim_groups(self):
+        groups = {}
+        for fi in self.tim_files:
+            groups.setdefault(fi['hash'], []).append(fi['offset'])
+        return groups
+
+    def tim_alias(self):
+        alias = {}
+        for offsets in self.tim_groups().values():
+            for ofs in offsets:
+                alias[ofs] = offsets[0]
+        return alias
+
+    @staticmethod
+    def file_finder(flist):
+        if isinstance(flist, c_scan_files):
+            return flist.find
+        return {fi['offset']: fi for fi in flist}.get
+
+    def file_index(self):
+        return {
+            'tim': self.file_finder(self.tim_files),
+            'uk': self.file_finder(self.unknown_files),
+        }
+
+    def check_import(self, fname, raw, index):
         try:
             tag, typ = fname.split('.')
             ofs, ukint = tag.split('_')
             ofs = int(ofs, 16)
         except:
             print('invalid file name: ' + fname)
-            return False
-        if typ == 'tim':
-            flist = self.tim_files
-        elif ename == 'uk':
-            typ = self.unknown_files
-        else:
+            return None
+        if not typ in index:
             print('invalid file type: ' + typ)
-            return False
-        for fi in flist:
-            lraw = len(raw)
-            if fi['offset'] == ofs:
-                if fi['size'] > lraw:
-                    raw += b'\00' * (fi['size'] - lraw)
-                elif fi['size'] < lraw:
-                    print('file too big: ' + str(lraw) + '/' + str(fi['size']))
-                    return False
-                break
-            elif fi['offset'] > ofs:
-                print('invalid offset: ' + hex(ofs))
-                return False
-        else:
+            return None
+        fi = index[typ](ofs)
+        if fi is None:
             print('invalid offset: ' + hex(ofs))
-            return False
-        self.raw = self.raw[:ofs] + raw + self.raw[ofs+len(raw):]
+            return None
+        lraw = len(raw)
+        if fi['size'] > lraw:
+            raw = bytes(raw) + b'\00' * (fi['size'] - lraw)
+        elif fi['size'] < lraw:
+            print('file too big: ' + str(lraw) + '/' + str(fi['size']))
+            return None
+        return ofs, raw, fi.get('hash')
+
+    def import_files(self, files):
+        index = self.file_index()
+        patches = {}
+        shared = []
+        for fname, raw in files:
+            pt = self.check_import(fname, raw, index)
+            if pt is None:
+                return False
+            ofs, raw, hsh = pt
+            patches[ofs] = raw
+            if hsh:
+                shared.append((hsh, raw))
+        if shared:
+            groups = self.tim_groups()
+            for hsh, raw in shared:
+                for ofs in groups[hsh]:
+                    if not ofs in patches:
+                        patches[ofs] = raw
+        for ofs in sorted(patches):
+            self.patch(ofs, patches[ofs])
         return True
 
+    def import_file(self, fname, raw):
+        return self.import_files([(fname, raw)])
+
 if __name__ == '__main__':
     
     work_path = r'G:\emu\ps\jpsxdec_v1-00_rev3921\extable\tc1'
     dest_file = 'DATA.BIN'
 
-    sav_file = 'timscan.json'
+    sav_file = 'timscan.idx'
     with open(os.path.join(work_path, dest_file), 'rb') as fd:
         scanner = c_tim_scanner(fd.read(), base_sect = 422)
     scanner.load_scan(os.path.join(work_path, sav_file))
@@ -3,9 +3,12 @@
 
 import os, os.path
 import json
+import hashlib
 
 import configparser
 
+import stat_parser as sp
+import monitor as mn
 from find_tim import c_tim_scanner
 from find_sj_text import c_text_finder
 from mod_text import c_text_tab
@@ -31,7 +34,8 @@ if __name__ == '__main__':
                     'main_file': 'SLPS_012.99',
                     'data_file': 'DATA.BIN',
                     'modbios_file': 'SCPH1001MOD.BIN',
-                    'modios_file': 'Tail Concerto (zh).bin',}})
+                    'modios_file': 'Tail Concerto (zh).bin',
+                    'scan_workers': '0',}})
             drity = True
         if not 'TIM' in cfg:
             cfg.update({
@@ -43,7 +47,8 @@ if __name__ == '__main__':
             cfg.update({
                 'TIMCONV': {
                     'enable': 'off',
-                    'png_path': r'png',}})
+                    'png_path': r'png',
+                    'workers': '0',}})
             drity = True
         if drity:
             with open(cfg_file, 'w') as fd:
@@ -75,17 +80,20 @@ if __name__ == '__main__':
         with open(ext_main, 'rb') as fd:
             main_raw = fd.read()
 
-        scan_sav = 'scan.json'
-        with open(ext_data, 'rb') as fd:
-            data_scanner = c_tim_scanner(fd.read())
-        data_scanner.load_scan(savp(scan_sav))
+        scan_sav = 'scan.idx'
+        mon = mn.c_monitor(mn.INFO)
+        data_scanner = c_tim_scanner(sp.map_file(ext_data), monitor = mon)
+        data_scanner.load_scan(
+            savp(scan_sav),
+            cfg['DEFAULT'].getint('scan_workers', 0), ext_data, True)
 
         text_sav = 'texts.json'
         text_tab = c_text_tab({
             cfg['DEFAULT']['main_file']: main_raw,
             cfg['DEFAULT']['data_file']: data_scanner,
-        })
+        }, mon)
         text_tab.load_texts(savp(text_sav))
+        data_scanner.finish_scan()
 
         tim_imported = False
         use_mod_data = False
@@ -105,7 +113,8 @@ if __name__ == '__main__':
 
             if cfg['TIMCONV']['enable'] != 'off':
                 
-                from convert_tim import c_tim_converter
+                from convert_tim import (
+                    c_conv_cache, convert_batch, png_worker, tim_worker)
                 
                 png_ext_path = os.path.join(
                     cfg['DEFAULT']['ext_path'], cfg['TIMCONV']['png_path'])
@@ -118,81 +127,107 @@ if __name__ == '__main__':
                     os.makedirs(png_sav_path)
                 psavp = lambda p: os.path.join(png_sav_path, p)
 
-                timconv_tab = {}
-                def get_timconv(tag):
-                    if tag in timconv_tab:
-                        tc = timconv_tab[tag]
-                    else:
-                        fn = textp(tag + '.tim')
-                        if not os.path.exists(fn):
-                            return None
-                        try:
-                            with open(fn, 'rb') as fd:
-                                tc = c_tim_converter(fd.read())
-                        except ValueError as e:
-                            if e.args[0] == 'empty body':
-                                return None
-                            raise
-                        timconv_tab[tag] = tc
-                    return tc
-                
+                conv_workers = cfg['TIMCONV'].getint('workers', 0)
+                conv_cache = c_conv_cache(savp('timconv'))
+
+                def write_tim(tag, tim):
+                    tfn = tsavp(tag + '.tim')
+                    if os.path.exists(tfn):
+                        with open(tfn, 'rb') as fd:
+                            if fd.read() == tim:
+                                return
+                    with open(tfn, 'wb') as fd:
+                        fd.write(tim)
+
+                tim_alias = data_scanner.tim_alias()
+                def is_alias(tag):
+                    try:
+                        ofs = int(tag.split('_')[0], 16)
+                    except:
+                        return False
+                    return tim_alias.get(ofs, ofs) != ofs
+
+                png_jobs = []
                 for fn in os.listdir(tim_ext_path):
                     tag = fn.split('.')[0]
-                    if fn.split('.')[-1] != 'tim':
+                    if fn.split('.')[-1] != 'tim' or is_alias(tag):
+                        continue
+                    if not os.path.exists(pextp(tag + '.png')):
+                        png_jobs.append((tag, textp(fn)))
+                for tag, png in convert_batch(
+                    png_worker, png_jobs, conv_workers):
+                    if png is None:
                         continue
-                    pfn = tag + '.png'
-                    if not os.path.exists(pextp(pfn)):
-                        timconv = get_timconv(tag)
-                        if not timconv:
-                            continue
-                        print('convert to png: ' + tag)
-                        timconv.save_png(pextp(pfn))
+                    print('convert to png: ' + tag)
+                    with open(pextp(tag + '.png'), 'wb') as fd:
+                        fd.write(png)
 
+                tim_jobs = []
+                tim_keys = {}
                 for fn in os.listdir(png_sav_path):
                     tag = fn.split('.')[0]
-                    if fn.split('.')[-1] != 'png':
+                    if fn.split('.')[-1] != 'png' or is_alias(tag):
                         continue
                     tfn = tag + '.tim'
-                    need_conv = True
-                    if os.path.exists(tsavp(tfn)):
-                        ts_t = os.path.getmtime(tsavp(tfn))
-                        ts_p = os.path.getmtime(psavp(fn))
-                        if ts_t >= ts_p:
-                            need_conv = False
-                    if need_conv:
-                        timconv = get_timconv(tag)
-                        if not timconv:
-                            continue
-                        print('convert to tim: ' + tag)
-                        timconv.load_png(psavp(fn))
-                        with open(tsavp(tfn), 'wb') as fd:
-                            fd.write(timconv.raw)
-
-            tim_timestamp = 'tim_timestamp'
-            for fn in os.listdir(tim_sav_path):
+                    if not os.path.exists(textp(tfn)):
+                        continue
+                    key = conv_cache.key(textp(tfn), psavp(fn))
+                    tim = conv_cache.get(key)
+                    if tim is None:
+                        tim_jobs.append((tag, textp(tfn), psavp(fn)))
+                        tim_keys[tag] = key
+                    else:
+                        write_tim(tag, tim)
+                for tag, tim in convert_batch(
+                    tim_worker, tim_jobs, conv_workers):
+                    if tim is None:
+                        continue
+                    print('convert to tim: ' + tag)
+                    conv_cache.put(tim_keys[tag], tim)
+                    write_tim(tag, tim)
+
+            tim_digest_fn = savp('tim_digest')
+            tim_batch = []
+            tim_digest = hashlib.md5()
+            for fn in sorted(os.listdir(tim_sav_path)):
                 if not os.path.exists(textp(fn)):
                     continue
                 try:
                     tim_ofs = int(fn.split('_')[0], 16)
                 except:
                     continue
-                if not c_text_tab.check_timestamp(
-                    tsavp(fn), savp(tim_timestamp), False):
-                    continue
-                tim_imported = True
                 with open(tsavp(fn), 'rb') as fd:
-                    if not data_scanner.import_file(fn, fd.read()):
-                        raise RuntimeError('invalid tim file: ' + fn)
-            if tim_imported:
+                    raw = fd.read()
+                tim_batch.append((fn, raw))
+                tim_digest.update('{}:{}\n'.format(
+                    fn, hashlib.md5(raw).hexdigest()).encode())
+            tim_digest = tim_digest.hexdigest()
+            try:
+                with open(tim_digest_fn, 'r') as fd:
+                    old_digest = fd.read().strip()
+            except OSError:
+                old_digest = None
+            # mod data file gets rewritten by text_tab, keep a separate
+            # tim-only image to map instead
+            tim_data_fn = savp('tim_' + cfg['DEFAULT']['data_file'])
+            if not tim_batch:
+                if not old_digest is None:
+                    # edits removed, rebuild from the original data
+                    if os.path.exists(tim_data_fn):
+                        os.remove(tim_data_fn)
+                    tim_digest = None
+                    tim_imported = True
+            elif (tim_digest != old_digest or
+                  not os.path.exists(tim_data_fn)):
+                if not data_scanner.import_files(tim_batch):
+                    raise RuntimeError('invalid tim files')
+                with open(tim_data_fn, 'wb') as fd:
+                    fd.write(data_scanner.raw)
+                tim_imported = True
                 print('tim imported')
-                c_text_tab.touch_timestamp(savp(tim_timestamp))
             else:
-                mod_data_fn = extractor.get_path(
-                    'mod', cfg['DEFAULT']['data_file'])
-                if os.path.exists(mod_data_fn):
-                    with open(mod_data_fn, 'rb') as fd:
-                        data_scanner.raw = fd.read()
-                    use_mod_data = True
+                data_scanner.raw = sp.map_file(tim_data_fn)
+                use_mod_data = True
         
         text_timestamp = 'timestamp'
         if text_tab.write_files(extractor.get_path('mod'),
@@ -203,6 +238,12 @@ if __name__ == '__main__':
             extractor.modify(outp(cfg['DEFAULT']['modios_file']))
             if not os.path.exists(outp(cfg['DEFAULT']['modios_file'])):
                 raise RuntimeError('iso modify failed')
+        if tim_imported:
+            if tim_digest is None:
+                os.remove(tim_digest_fn)
+            else:
+                with open(tim_digest_fn, 'w') as fd:
+                    fd.write(tim_digest)
         
         return text_tab
     
@@ -3,17 +3,22 @@
 
 import os, os.path
 import json
+import mmap
 
 from collections import OrderedDict
 
 from find_sj_text import c_text_finder
 from mod_charset import std_filler
+import monitor as mn
+
+raw_types = (bytes, bytearray, memoryview, mmap.mmap)
 
 class c_text_tab:
 
     VERSION = 1.01
 
-    def __init__(self, srcs):
+    def __init__(self, srcs, monitor = None):
+        self.mon = monitor if monitor else mn.c_monitor()
         self.texts = []
         self.filler = std_filler()
         self.srclist = OrderedDict(srcs)
@@ -23,21 +28,25 @@ class c_text_tab:
         self.texts_fname = None
         
     def scan_raw_text(self, raw, tag):
-        print('scan', tag)
-        tfinder = c_text_finder(raw)
+        self.mon.log(mn.VERBOSE, 'scan', tag)
+        tfinder = c_text_finder(raw, monitor = self.mon)
         tfinder.scan()
         if tfinder.text_list and len(tfinder.text_list) > 0:
             self.texts.append((tag, tfinder.text_list))
 
     def scan_text(self, scanner, tag):
-        for raw, stag in scanner.iter_ukraw():
+        total = None
+        if scanner.scan_done:
+            total = len(scanner.unknown_files)
+        for i, (raw, stag) in enumerate(scanner.iter_ukraw()):
             self.scan_raw_text(raw, tag + ':' + stag)
+            self.mon.progress('text_chunks', i + 1, total, unit = 'chunks')
 
     def scan(self):
         if self.scan_done:
             return
         for tag, src in self.srclist.items():
-            if isinstance(src, bytes):
+            if isinstance(src, raw_types):
                 self.scan_raw_text(src, tag)
             else:
                 self.scan_text(src, tag)
@@ -53,8 +62,10 @@ class c_text_tab:
                 offset = int(tag[1].split('_')[0], 16)
             tag = tag[0]
             raw = self.srclist[tag]
-            if not isinstance(raw, bytes):
+            if not isinstance(raw, raw_types):
                 raw = raw.raw
+            if not isinstance(raw, bytearray) and memoryview(raw).readonly:
+                raw = bytearray(raw)
             for txt_info in txt_group:
                 try:
                     txt_trans, txt_offset = c_text_finder.valid_trans(txt_info)
@@ -73,7 +84,7 @@ class c_text_tab:
                 sofs = txt_offset + offset
                 eofs = sofs + len(encode_trans)
                 self.modified = True
-                raw = raw[:sofs] + encode_trans + raw[eofs:]
+                raw[sofs:eofs] = encode_trans
             self.srclist[tag] = raw
         self.import_done = True
 
@@ -224,7 +235,7 @@ class c_text_tab:
         if not force and not self.modified:
             return False
         for tag, raw in self.srclist.items():
-            if not isinstance(raw, bytes):
+            if not isinstance(raw, raw_types):
                 raw = raw.raw
             with open(fn_prefix + tag, 'wb') as fd:
                 fd.write(raw)
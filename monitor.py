@@ -0,0 +1,100 @@
+#! python3
+# coding: utf-8
+
+import time
+
+SILENT = 0
+INFO = 1
+VERBOSE = 2
+
+class c_monitor:
+
+    def __init__(self, level = VERBOSE, interval = 1.0,
+                 on_progress = None, on_event = None):
+        self.level = level
+        self.interval = interval
+        self.on_progress = on_progress
+        self.on_event = on_event
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.starts = {}
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def log(self, level, *args, **kargs):
+        if level <= self.level:
+            print(*args, **kargs)
+
+    def start(self, name):
+        if not name in self.starts:
+            self.starts[name] = time.monotonic()
+
+    def count(self, name, n = 1):
+        self.start(name)
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def event(self, name, **info):
+        self.count(name)
+        if self.on_event:
+            self.on_event(name, info)
+
+    def elapsed(self, name = None):
+        return time.monotonic() - self.starts.get(name, self.start_time)
+
+    def rate(self, name):
+        el = self.elapsed(name)
+        if el <= 0:
+            return 0
+        return self.counters.get(name, 0) / el
+
+    def progress(self, name, done, total = None, force = False,
+                 unit = 'items', scale = 1):
+        if done < self.counters.get(name, 0):
+            self.starts.pop(name, None)
+        self.start(name)
+        self.counters[name] = done
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        if self.on_progress:
+            self.on_progress(name, done, total, self.rate(name))
+        elif self.level >= INFO:
+            if total:
+                done = '{:.1f}%'.format(done * 100 / total)
+            else:
+                done = '{:g}'.format(done / scale)
+            print('{}: {} ({:.2f} {}/s)'.format(
+                name, done, self.rate(name) / scale, unit))
+
+    def summary(self):
+        return {
+            'elapsed': self.elapsed(),
+            'counters': dict(self.counters),
+            'rates': {k: self.rate(k) for k in self.counters},
+        }
+
+class c_silent_monitor(c_monitor):
+
+    def __init__(self):
+        super().__init__(SILENT)
+
+    def log(self, level, *args, **kargs):
+        pass
+
+    def count(self, name, n = 1):
+        pass
+
+    def event(self, name, **info):
+        pass
+
+    def progress(self, name, done, total = None, force = False,
+                 unit = 'items', scale = 1):
+        pass
+
+silent_monitor = c_silent_monitor()
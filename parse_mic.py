@@ -23,12 +23,11 @@ mic_file_entry = sp.desc_pack(
 
 mic_sectab_offset = 0x3000
 
-class c_mic_file:
+class c_mic_file(sp.c_reader):
 
     def __init__(self, raw, sect_size = 0x800, sectab_offs = mic_sectab_offset):
-        self.raw = raw
+        super().__init__(raw)
         self.sect_size = 0x800
-        self.pos = 0
         self.groups = {}
         self.sectab = {}
         self.sectab_pos = sectab_offs
@@ -36,16 +35,6 @@ class c_mic_file:
         self.scan_done = False
         self.curdir = []
 
-    def get_pack(self, desc, noshift = False):
-        if self.pos >= len(self.raw):
-            return None
-        spos = self.pos
-        dpos = spos + len(desc)
-        if not noshift:
-            self.pos = dpos
-        return sp.data_pack(desc,
-                            self.raw[spos:dpos])
-
     @staticmethod
     def isempty(dat):
         buf = dat.buffer()
@@ -65,15 +54,20 @@ class c_mic_file:
     def scan_header(self):
         if self.pos > 0:
             return
-        ent_idx = 0
-        while self.where() == 'header':
-            dat = self.get_pack(mic_group_entry)
-            if dat['size'].value == 0:
-                if not self.isempty(dat):
-                    print('invalid group entry:', dat.buffer())
+        ent_len = len(mic_group_entry)
+        ent_num = math.ceil((self.sectab_pos - self.pos) / ent_len)
+        raw, ofs = self.window(self.pos, ent_num * ent_len)
+        tab = sp.data_table(mic_group_entry, raw, ofs, ent_num)
+        for ent_idx in range(ent_num):
+            epos = self.pos
+            self.pos += ent_len
+            if tab['size'][ent_idx] == 0:
+                if any(col[ent_idx] for col in tab.values()):
+                    print('invalid group entry:',
+                          bytes(self.raw[epos:self.pos]))
             else:
-                o_sec = dat['offset'].value
-                s_sec = dat['size'].value
+                o_sec = tab['offset'][ent_idx]
+                s_sec = tab['size'][ent_idx]
                 o_addr = o_sec * self.sect_size
                 s_addr = s_sec * self.sect_size
                 self.groups[ent_idx] = {
@@ -82,7 +76,6 @@ class c_mic_file:
                 }
                 if o_addr < self.body_pos:
                     self.body_pos = o_addr
-            ent_idx += 1
 
     def scan_sectab(self):
         if self.pos != self.sectab_pos:
@@ -115,23 +108,34 @@ class c_mic_file:
             return
         grp['files'] = {}
         last_fdesc = None
-        while True:
-            dat = self.get_pack(mic_file_entry)
-            is_eof = self.isempty(dat['name'])
-            if is_eof:
-                fname = '__eof__'
-            else:
-                fname = dat['name'].value.decode().strip('\0')
-            f_addr = gpos + dat['offset'].value
-            fdesc = {
-                'offset': f_addr,
-            }
-            if last_fdesc:
-                last_fdesc['size'] = f_addr - last_fdesc['offset']
-            grp['files'][fname] = fdesc
-            last_fdesc = fdesc
-            if is_eof:
-                break
+        ent_len = len(mic_file_entry)
+        ent_num = 0x20
+        is_eof = False
+        while not is_eof:
+            ent_num = min(ent_num, int((len(self.raw) - self.pos) / ent_len))
+            if ent_num <= 0:
+                print('missing group eof:', gpos)
+                return
+            raw, ofs = self.window(self.pos, ent_num * ent_len)
+            tab = sp.data_table(mic_file_entry, raw, ofs, ent_num)
+            for name, offset in zip(tab['name'], tab['offset']):
+                self.pos += ent_len
+                is_eof = (name == bytes(len(name)))
+                if is_eof:
+                    fname = '__eof__'
+                else:
+                    fname = name.decode().strip('\0')
+                f_addr = gpos + offset
+                fdesc = {
+                    'offset': f_addr,
+                }
+                if last_fdesc:
+                    last_fdesc['size'] = f_addr - last_fdesc['offset']
+                grp['files'][fname] = fdesc
+                last_fdesc = fdesc
+                if is_eof:
+                    break
+            ent_num *= 2
 
     def scan(self):
         if self.scan_done:
@@ -281,23 +285,12 @@ prog_header = sp.desc_pack(
     ('codelen', sp.desc_uint),
 )
 
-class c_prog_file:
+class c_prog_file(sp.c_reader):
 
     def __init__(self, raw):
-        self.raw = raw
-        self.pos = 0
+        super().__init__(raw)
         self.scan_done = False
 
-    def get_pack(self, desc, noshift = False):
-        if self.pos >= len(self.raw):
-            return None
-        spos = self.pos
-        dpos = spos + len(desc)
-        if not noshift:
-            self.pos = dpos
-        return sp.data_pack(desc,
-                            self.raw[spos:dpos])
-
     @staticmethod
     def cutbuf(buf, splt_char = 0, has_empty = False):
         blen = len(buf)
@@ -331,7 +324,7 @@ class c_prog_file:
     def scan_header(self):
         if self.pos > 0:
             return False
-        dat = self.get_pack(prog_header)
+        dat = self.read_pack(prog_header)
         if dat['headlen'].value != 8:
             print('invalid prog header length:', dat['headlen'].value)
             return False
@@ -358,14 +351,14 @@ class c_prog_file:
         if self.pos != self.data_pos:
             print('invalid ukdata offset')
             return False
-        self.ukdata = self.get_pack(sp.desc_buf(self.res_pos - self.data_pos))
+        self.ukdata = self.read_pack(sp.desc_buf(self.res_pos - self.data_pos))
         return True
 
     def scan_res(self):
         if self.pos != self.res_pos:
             print('invalid res offset')
             return False
-        dat = self.get_pack(sp.desc_buf(self.str_pos - self.res_pos))
+        dat = self.read_pack(sp.desc_buf(self.str_pos - self.res_pos))
         spbuf = self.cutbuf(dat, 0xa0, True)
         res = []
         self.pos = self.res_pos
@@ -380,7 +373,7 @@ class c_prog_file:
                 if self.pos != offset:
                     print('invalid res seg')
                     return False
-                dat = self.get_pack(sp.desc_buf(size))
+                dat = self.read_pack(sp.desc_buf(size))
                 rdesc['data'] = dat
             res.append(rdesc)
             self.pos += 1
@@ -402,8 +395,8 @@ class c_prog_file:
         if tablen % 2 or tablen == 0:
             print('invalid prog header tab length:', tablen)
             return None
-        tabdesc = sp.desc_arr(int(tablen / 2), sp.desc_uword)
-        dat = self.get_pack(tabdesc)
+        tabdesc = sp.desc_tarr(int(tablen / 2), sp.desc_uword)
+        dat = self.read_pack(tabdesc)
         segs = []
         last_seg = None
         seg_base = 0
@@ -431,7 +424,7 @@ class c_prog_file:
             print('invalid seg offset: 0x{:x}/0x{:x}'.format(
                 self.pos, segdesc['offset']))
             return False
-        dat = self.get_pack(sp.desc_buf(segdesc['size']))
+        dat = self.read_pack(sp.desc_buf(segdesc['size']))
         for i in range(0, len(dat), 2):
             if dat[i:i+2].value == b'\xff\xff':
                 tablen = i
@@ -468,7 +461,7 @@ class c_prog_file:
             print('invalid dat offset: 0x{:x}/0x{:x}'.format(
                 self.pos, desc['offset']))
             return False
-        dat = self.get_pack(sp.desc_buf(desc['size']))
+        dat = self.read_pack(sp.desc_buf(desc['size']))
         desc['data'] = dat
         return True
 
@@ -486,8 +479,8 @@ class c_prog_file:
         buf = codedesc['data']
         cmds = []
         for i in range(0, len(buf) - 1, 3):
-            cmd = sp.data_pack(
-                self.codecmd_desc, buf[i:i+3])
+            cmd = sp.data_view(
+                self.codecmd_desc, buf.value, i)
             cmds.append(cmd)
             if self.res_pos is None:
                 self.res_pos = cmd['val'].value
@@ -599,7 +592,7 @@ def cutstring(buf, enc = 'shift-jis', eos = b'\0', maxlen = 200):
     return buf[:rlen].decode(enc, errors = 'ignore')
 
 def cutdat(dat, paddr, **kargs):
-    addr = sp.data_pack(sp.desc_uword, dat[paddr:paddr+2]).value
+    addr = sp.data_view(sp.desc_uword, dat.value, paddr).value
     return cutstring(dat[addr:].value, **kargs)
 
 def ptxt(dat, st, ed):
@@ -1,8 +1,16 @@
 #! python3
 # coding: utf-8
 
+import os
+import sys
 import math
+import mmap
+import struct
+import array
+import functools
+import itertools
 from collections import OrderedDict
+from collections.abc import Mapping
 from pprint import pprint
 import codecs
 
@@ -17,14 +25,51 @@ class c_desc:
     def lazy(hndl):
         name = hndl.__name__
         def _lzmethod(self, *args, **kargs):
-            if not name in self.lazy_props:
-                self.lazy_props[name] = hndl(self, *args, **kargs)
-            return self.lazy_props[name]
+            try:
+                return self.lazy_props[name]
+            except KeyError:
+                pass
+            val = hndl(self, *args, **kargs)
+            self.lazy_props[name] = val
+            return val
         return _lzmethod
 
     @staticmethod
     def getbuf(raw, offset, length):
-        return raw[offset: offset + length]
+        buf = raw[offset: offset + length]
+        if isinstance(buf, memoryview):
+            buf = buf.tobytes()
+        return buf
+
+    def layout(self):
+        return None
+
+    def codec(self):
+        if not 'codec' in self.lazy_props:
+            lo = self.layout()
+            if lo is None:
+                codec = None
+            else:
+                order, codes = lo
+                codec = struct.Struct((order or '<') + codes)
+            self.lazy_props['codec'] = codec
+        return self.lazy_props['codec']
+
+    def nitems(self):
+        if not 'nitems' in self.lazy_props:
+            self.lazy_props['nitems'] = len(
+                self.codec().unpack(bytes(len(self))))
+        return self.lazy_props['nitems']
+
+    def compiled(self, raw, offset, container):
+        vals = self.codec().unpack_from(raw, offset)
+        return self.unflat(iter(vals), offset, container)
+
+    def unflat(self, vals, offset = 0, container = None):
+        return NotImplemented
+
+    def flat(self, val):
+        return NotImplemented
 
     def placein(self, val, container, offset):
         if container:
@@ -46,6 +91,14 @@ class c_desc:
     def buffer(self, buf):
         return bytes(buf)
 
+    def pack_into(self, buf, offset, val):
+        codec = self.codec()
+        if codec:
+            codec.pack_into(buf, offset, *self.flat(val))
+        else:
+            rs = self.buffer(val)[:len(self)]
+            buf[offset: offset + len(rs)] = rs
+
     def show(self, val):
         if hasattr(val, 'show'):
             return val.show()
@@ -57,9 +110,18 @@ class c_desc_void(c_desc):
     def __len__(self):
         return 0
 
+    def layout(self):
+        return None, ''
+
     def value(self, raw, offset = 0, container = None):
         return self.placein(0, container, offset)
 
+    def unflat(self, vals, offset = 0, container = None):
+        return self.placein(0, container, offset)
+
+    def flat(self, val):
+        return ()
+
     def buffer(self, buf):
         return b''
 
@@ -68,6 +130,9 @@ class c_desc_void(c_desc):
 
 class c_desc_int_le(c_desc):
 
+    byteorder = '<'
+    struct_codes = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
     def __init__(self, length, signed = False):
         super().__init__()
         self.length = length
@@ -97,23 +162,52 @@ class c_desc_int_le(c_desc):
             arr = arr[:self.length]
         return arr
 
-    def value(self, raw, offset = 0, container = None):
-        buf = self.getbuf(raw, offset, self.length)
-        val = self.buf2num(buf)
+    def fixnum(self, val):
         sbit = (1 << (self.length * 8 - 1))
+        val &= (sbit << 1) - 1
         if self.signed and (val & sbit):
             val -= (sbit << 1)
+        return val
+
+    def layout(self):
+        code = self.struct_codes.get(self.length)
+        if code is None:
+            return None, '{}s'.format(self.length)
+        if self.signed:
+            code = code.lower()
+        return self.byteorder, code
+
+    def value(self, raw, offset = 0, container = None):
+        if not self.length in self.struct_codes:
+            return self.compiled(raw, offset, container)
+        val = self.codec().unpack_from(raw, offset)[0]
         return self.placein(val, container, offset)
 
-    def buffer(self, val):
+    def unflat(self, vals, offset = 0, container = None):
+        val = next(vals)
+        if not self.length in self.struct_codes:
+            val = self.fixnum(self.buf2num(val))
+        if container:
+            return container(self, val, offset)
+        return val
+
+    def flat(self, val):
         val = self.placeout(val)
-        return super().buffer(self.num2arr(val))
+        if self.length in self.struct_codes:
+            yield self.fixnum(val)
+        else:
+            yield bytes(self.num2arr(val & ((1 << (self.length * 8)) - 1)))
+
+    def buffer(self, val):
+        return self.codec().pack(*self.flat(val))
 
     def show(self, val):
         return hex(val)
 
 class c_desc_int_be(c_desc_int_le):
 
+    byteorder = '>'
+
     def buf2num(self, buf):
         val = 0
         for v in buf:
@@ -147,11 +241,21 @@ class c_desc_buf(c_desc):
         return self.length
 
     def getslice(self, st, ed):
-        return c_desc_buf(ed - st, st)
+        return desc_buf(max(ed - st, 0), st)
+
+    def layout(self):
+        return None, '{}s'.format(self.length)
 
     def value(self, raw, offset = 0, container = None):
-        buf = self.getbuf(raw, offset, self.length)
-        return self.placein(buf, container, offset)
+        if container:
+            return container(self, None, offset, (raw, offset))
+        return self.getbuf(raw, offset, self.length)
+
+    def unflat(self, vals, offset = 0, container = None):
+        return self.placein(next(vals), container, offset)
+
+    def flat(self, buf):
+        yield bytes(self.placeout(buf))
 
     def buffer(self, buf):
         buf = self.placeout(buf)
@@ -199,7 +303,20 @@ class c_desc_arr(c_desc):
     def __len__(self):
         return len(self.subdesc) * self.length
 
+    def layout(self):
+        lo = self.subdesc.layout()
+        if lo is None:
+            return None
+        order, codes = lo
+        if len(codes) == 1:
+            codes = '{}{}'.format(self.length, codes)
+        else:
+            codes = codes * self.length
+        return order, codes
+
     def value(self, raw, offset = 0, container = None):
+        if self.codec():
+            return self.compiled(raw, offset, container)
         arr = []
         pos = offset
         step = len(self.subdesc)
@@ -208,18 +325,86 @@ class c_desc_arr(c_desc):
             pos += step
         return self.placein(arr, container, offset)
 
-    def buffer(self, arr):
+    def unflat(self, vals, offset = 0, container = None):
+        arr = []
+        pos = offset
+        step = len(self.subdesc)
+        for i in range(self.length):
+            arr.append(self.subdesc.unflat(vals, pos, container))
+            pos += step
+        return self.placein(arr, container, offset)
+
+    def flat(self, arr):
         arr = self.placeout(arr)
-        buf = b''
         for i in range(self.length):
-            val = arr[i]
-            buf += self.subdesc.buffer(val)
-        return buf
+            yield from self.subdesc.flat(arr[i])
+
+    def pack_into(self, buf, offset, arr):
+        codec = self.codec()
+        if codec:
+            codec.pack_into(buf, offset, *self.flat(arr))
+            return
+        arr = self.placeout(arr)
+        step = len(self.subdesc)
+        for i in range(self.length):
+            self.subdesc.pack_into(buf, offset + i * step, arr[i])
+
+    def buffer(self, arr):
+        buf = bytearray(len(self))
+        self.pack_into(buf, 0, arr)
+        return bytes(buf)
 
     def show(self, val):
         sup = super()
         return [sup.show(v) for v in val]
 
+class c_desc_tarr(c_desc_arr):
+
+    def __init__(self, length, subdesc):
+        super().__init__(length, subdesc)
+        self.typecode = array_typecode(len(subdesc), subdesc.signed)
+        if self.typecode is None:
+            raise ValueError('invalid typed array item: {}'.format(
+                len(subdesc)))
+        self.swapped = (
+            (subdesc.byteorder == '<') != (sys.byteorder == 'little'))
+
+    def toarray(self, buf):
+        arr = array.array(self.typecode)
+        arr.frombytes(buf)
+        if self.swapped:
+            arr.byteswap()
+        return arr
+
+    def tobytes(self, arr):
+        if self.swapped or not isinstance(arr, array.array):
+            arr = array.array(self.typecode, arr)
+            if self.swapped:
+                arr.byteswap()
+        return arr.tobytes()
+
+    def layout(self):
+        return None, '{}s'.format(len(self))
+
+    def value(self, raw, offset = 0, container = None):
+        buf = memoryview(raw)[offset: offset + len(self)]
+        return self.placein(self.toarray(buf), container, offset)
+
+    def unflat(self, vals, offset = 0, container = None):
+        return self.placein(self.toarray(next(vals)), container, offset)
+
+    def flat(self, arr):
+        yield self.tobytes(self.placeout(arr))
+
+    def buffer(self, arr):
+        return self.tobytes(self.placeout(arr))
+
+    def getitem(self, dat, key):
+        return c_data_item(dat, key)
+
+    def show(self, val):
+        return [self.subdesc.show(v) for v in val]
+
 class c_desc_pack(c_desc):
 
     def __init__(self, *items):
@@ -233,7 +418,57 @@ class c_desc_pack(c_desc):
     def __getitem__(self, key):
         return self.items[key]
 
+    @c_desc.lazy
+    def fields(self):
+        rs = []
+        pos = 0
+        for key, desc in self.items.items():
+            rs.append((key, desc, pos))
+            pos += len(desc)
+        return rs
+
+    @c_desc.lazy
+    def fieldmap(self):
+        return {key: (desc, pos) for key, desc, pos in self.fields()}
+
+    @c_desc.lazy
+    def flatmap(self):
+        rs = {}
+        idx = 0
+        for key, desc, pos in self.fields():
+            n = desc.nitems()
+            # plain ints map to one unpacked value as is
+            direct = (isinstance(desc, c_desc_int_le) and
+                      desc.length in desc.struct_codes)
+            rs[key] = (desc, pos, idx, idx + n, direct)
+            idx += n
+        return rs
+
+    def layout(self):
+        orders = set()
+        codes = ''
+        for desc in self.items.values():
+            lo = desc.layout()
+            if lo is None:
+                return None
+            if lo[0]:
+                orders.add(lo[0])
+            codes += lo[1]
+        if len(orders) > 1:
+            return None
+        return (orders.pop() if orders else None), codes
+
     def value(self, raw, offset = 0, container = None):
+        if getattr(container, 'lazy', False):
+            pack = c_lazy_pack(self, raw, offset, container)
+            return self.placein(pack, container, offset)
+        codec = self.codec()
+        if codec and container:
+            pack = c_flat_pack(
+                self, codec.unpack_from(raw, offset), offset, container)
+            return self.placein(pack, container, offset)
+        elif codec:
+            return self.compiled(raw, offset, container)
         pack = OrderedDict()
         pos = offset
         for key, desc in self.items.items():
@@ -241,18 +476,131 @@ class c_desc_pack(c_desc):
             pos += len(desc)
         return self.placein(pack, container, offset)
 
+    def unflat(self, vals, offset = 0, container = None):
+        if container:
+            vals = tuple(itertools.islice(vals, self.nitems()))
+            pack = c_flat_pack(self, vals, offset, container)
+            return self.placein(pack, container, offset)
+        pack = OrderedDict()
+        for key, desc, pos in self.fields():
+            pack[key] = desc.unflat(vals, offset + pos, container)
+        return self.placein(pack, container, offset)
+
+    def flat(self, pack):
+        pack = self.placeout(pack)
+        for key, desc in self.items.items():
+            yield from desc.flat(pack[key])
+
+    def pack_into(self, buf, offset, pack):
+        pack = self.placeout(pack)
+        if isinstance(pack, c_lazy_pack):
+            pack.pack_into(buf, offset)
+            return
+        codec = self.codec()
+        if codec:
+            codec.pack_into(buf, offset, *self.flat(pack))
+            return
+        for key, desc, pos in self.fields():
+            desc.pack_into(buf, offset + pos, pack[key])
+
     def buffer(self, pack):
         pack = self.placeout(pack)
-        buf = b''
-        for key, val in pack.items():
-            desc = self.items[key]
-            buf += desc.buffer(val)
-        return buf
+        if isinstance(pack, c_lazy_pack):
+            return pack.buffer()
+        buf = bytearray(len(self))
+        self.pack_into(buf, 0, pack)
+        return bytes(buf)
 
     def show(self, val):
         sup = super()
         return [(k, sup.show(v)) for k, v in val.items()]
 
+class c_lazy_pack(Mapping):
+
+    def __init__(self, desc, raw, offset, container):
+        self.desc = desc
+        self.raw = raw
+        self.offset = offset
+        self.container = container
+        self.cache = {}
+
+    def __getitem__(self, key):
+        if key in self.cache:
+            return self.cache[key]
+        desc, pos = self.desc.fieldmap()[key]
+        val = desc.value(self.raw, self.offset + pos, self.container)
+        self.cache[key] = val
+        return val
+
+    def __iter__(self):
+        return iter(self.desc.items)
+
+    def __len__(self):
+        return len(self.desc.items)
+
+    def modified(self):
+        for val in self.cache.values():
+            if data_modified(val):
+                return True
+        return False
+
+    def pack_into(self, buf, offset):
+        buf[offset: offset + len(self.desc)] = self.desc.getbuf(
+            self.raw, self.offset, len(self.desc))
+        fmap = self.desc.fieldmap()
+        for key, val in self.cache.items():
+            if not data_modified(val):
+                continue
+            desc, pos = fmap[key]
+            desc.pack_into(buf, offset + pos, val)
+
+    def buffer(self):
+        if not self.modified():
+            return bytes(self.desc.getbuf(
+                self.raw, self.offset, len(self.desc)))
+        buf = bytearray(len(self.desc))
+        self.pack_into(buf, 0)
+        return bytes(buf)
+
+class c_flat_pack(c_lazy_pack):
+
+    def __init__(self, desc, vals, offset, container):
+        self.desc = desc
+        self.vals = vals
+        self.offset = offset
+        self.container = container
+        self.cache = {}
+        self.fmap = desc.flatmap()
+
+    def __getitem__(self, key):
+        cache = self.cache
+        if key in cache:
+            return cache[key]
+        desc, pos, st, ed, direct = self.fmap[key]
+        if direct:
+            val = self.container(desc, self.vals[st], self.offset + pos)
+        else:
+            val = desc.unflat(
+                iter(self.vals[st: ed]), self.offset + pos, self.container)
+        cache[key] = val
+        return val
+
+    def pack_into(self, buf, offset):
+        self.desc.codec().pack_into(buf, offset, *self.vals)
+        fmap = self.desc.fieldmap()
+        for key, val in self.cache.items():
+            if not data_modified(val):
+                continue
+            desc, pos = fmap[key]
+            desc.pack_into(buf, offset + pos, val)
+
+    def buffer(self):
+        if not self.modified():
+            return self.desc.codec().pack(*self.vals)
+        buf = bytearray(len(self.desc))
+        self.pack_into(buf, 0)
+        return bytes(buf)
+
 desc_void = c_desc_void()
 if ENDIAN == 'LE':
     c_desc_int = c_desc_int_le
@@ -267,16 +615,49 @@ desc_int = c_desc_int(4, True)
 desc_ulong = c_desc_int(8)
 desc_long = c_desc_int(8, True)
 desc_enum = desc_float = desc_pointer = desc_uint
-desc_buf = c_desc_buf
-desc_arr = c_desc_arr
-desc_pack = c_desc_pack
+
+def interned(cls, maxsize = 4096):
+    @functools.lru_cache(maxsize = maxsize)
+    def _make(*args, **kargs):
+        return cls(*args, **kargs)
+    return _make
+
+desc_buf = interned(c_desc_buf)
+desc_arr = interned(c_desc_arr)
+desc_tarr = interned(c_desc_tarr)
+desc_pack = interned(c_desc_pack)
+
+def array_typecode(length, signed = False, exact = True):
+    for code in 'bhilq':
+        isz = array.array(code).itemsize
+        if isz == length or (not exact and isz > length):
+            return code if signed else code.upper()
+    return None
 
 class c_data:
 
-    def __init__(self, desc, val = None, offset = 0):
+    lazy = False
+
+    def __init__(self, desc, val = None, offset = 0, src = None):
         self.desc = desc
-        self.value = val
+        self._value = val
         self.offset = offset
+        self.src = src
+        self.dirty = False
+
+    @property
+    def value(self):
+        if not self.src is None:
+            raw, ofs = self.src
+            self._value = self.desc.getbuf(raw, ofs, len(self.desc))
+            self.src = None
+        return self._value
+
+    @value.setter
+    def value(self, val):
+        self._value = val
+        self.src = None
+        self.dirty = True
 
     def __bool__(self):
         return True
@@ -285,31 +666,137 @@ class c_data:
         return len(self.desc)
 
     def __getitem__(self, key):
-        if isinstance(key, slice) and hasattr(self.desc, 'getslice'):
-            st = key.start
-            if st is None:
-                st = 0
-            ed = key.stop
-            if ed is None:
-                ed = len(self)
+        if key.__class__ is str:
+            return self.value[key]
+        elif isinstance(key, slice) and hasattr(self.desc, 'getslice'):
+            st, ed, step = key.indices(len(self))
+            if step != 1:
+                return self.value[key]
+            ed = max(ed, st)
             slcdesc = self.desc.getslice(st, ed)
-            return slcdesc.value(self.buffer(), st, c_data)
+            if self.src is None:
+                src = (self.value, st)
+            else:
+                src = (self.src[0], self.src[1] + st)
+            return c_data(slcdesc, None, st, src)
+        elif isinstance(key, int) and hasattr(self.desc, 'getitem'):
+            return self.desc.getitem(self, key)
         return self.value[key]
 
     def buffer(self):
         return self.desc.buffer(self.value)
 
+    def pack_into(self, buf, offset = 0):
+        self.desc.pack_into(buf, offset, self.value)
+
+    def modified(self):
+        return data_modified(self)
+
     def show(self, *args, **kargs) :
         return self.desc.show(self.value, *args, **kargs)
 
+class c_data_lazy(c_data):
+
+    lazy = True
+
+class c_data_item(c_data):
+
+    def __init__(self, parent, idx):
+        rlen = len(parent.value)
+        if idx < 0:
+            idx += rlen
+        if not 0 <= idx < rlen:
+            raise IndexError('item index out of range')
+        self.parent = parent
+        self.idx = idx
+        self.src = None
+        self.dirty = False
+        self.desc = parent.desc.subdesc
+        self.offset = parent.offset + idx * len(self.desc)
+
+    @property
+    def value(self):
+        return self.parent.value[self.idx]
+
+    @value.setter
+    def value(self, val):
+        if isinstance(self.desc, c_desc_int_le):
+            val = self.desc.fixnum(val)
+        self.parent.value[self.idx] = val
+        self.parent.dirty = True
+        self.dirty = True
+
 def data_pack(desc, raw = None):
     if raw is None:
         raw = bytes(len(desc))
-    elif len(raw) != len(desc):
+    elif isinstance(raw, c_data):
+        raw = raw.buffer()
+    if len(raw) != len(desc):
         raise ValueError('desc length not match: {}/{}'.format(
             len(raw), len(desc)))
     return desc.value(raw, 0, c_data)
 
+def data_view(desc, raw, offset = 0, lazy = False):
+    if isinstance(raw, c_data):
+        raw = raw.buffer()
+    if offset < 0 or len(raw) - offset < len(desc):
+        raise ValueError('desc length out of range: {}/{}'.format(
+            len(raw) - offset, len(desc)))
+    return desc.value(raw, offset, c_data_lazy if lazy else c_data)
+
+def data_table(desc, raw, offset = 0, count = None):
+    codec = desc.codec()
+    if codec is None:
+        raise ValueError('desc has no fixed layout')
+    if isinstance(raw, c_data):
+        raw = raw.buffer()
+    if count is None:
+        count = int((len(raw) - offset) / codec.size)
+    edpos = offset + codec.size * count
+    if offset < 0 or count < 0 or edpos > len(raw):
+        raise ValueError('table length out of range: {}/{}'.format(
+            len(raw) - offset, codec.size * count))
+    rows = codec.iter_unpack(memoryview(raw)[offset: edpos])
+    cols = list(zip(*rows))
+    if not cols:
+        cols = [()] * desc.nitems()
+    tab = OrderedDict()
+    idx = 0
+    for key, fdesc, pos in desc.fields():
+        n = fdesc.nitems()
+        if isinstance(fdesc, c_desc_int_le):
+            col = cols[idx]
+            if not fdesc.length in fdesc.struct_codes:
+                col = [fdesc.unflat(iter((v,))) for v in col]
+            tab[key] = array.array(
+                array_typecode(fdesc.length, fdesc.signed, False), col)
+        elif n == 0:
+            tab[key] = [fdesc.unflat(iter(()))] * count
+        else:
+            tab[key] = [fdesc.unflat(iter(vals))
+                        for vals in zip(*cols[idx: idx + n])]
+        idx += n
+    return tab
+
+def data_modified(dat):
+    if not isinstance(dat, c_data):
+        return False
+    if dat.dirty:
+        return True
+    elif not dat.src is None:
+        return False
+    val = dat.value
+    if isinstance(val, c_lazy_pack):
+        return val.modified()
+    elif isinstance(val, dict):
+        val = val.values()
+    elif not isinstance(val, list):
+        return False
+    for v in val:
+        if data_modified(v):
+            return True
+    return False
+
 def data_update(dat, val):
     if type(val) is dict:
         for k in val:
@@ -319,6 +806,149 @@ def data_update(dat, val):
             data_update(dat[i], v)
     else:
         dat.value = val
+
+def map_file(fn, copy = True):
+    with open(fn, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(fd.fileno(), 0, access = (
+            mmap.ACCESS_COPY if copy else mmap.ACCESS_READ))
+
+class c_file_raw:
+
+    def __init__(self, fd, bufsize = 0x10000):
+        self.fd = fd
+        self.bufsize = bufsize
+        fd.seek(0, 2)
+        self.size = fd.tell()
+        self.cache = b''
+        self.cache_pos = 0
+
+    def __len__(self):
+        return self.size
+
+    def window(self, offset, length):
+        cpos = self.cache_pos
+        if not (cpos <= offset and
+                offset + length <= cpos + len(self.cache)):
+            self.fd.seek(offset)
+            self.cache = self.fd.read(max(length, self.bufsize))
+            self.cache_pos = cpos = offset
+        return self.cache, offset - cpos
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            st, ed, step = key.indices(self.size)
+            if step != 1:
+                raise ValueError('file slice step not supported')
+            rlen = max(ed - st, 0)
+            buf, ofs = self.window(st, rlen)
+            return buf[ofs: ofs + rlen]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('file index out of range')
+        buf, ofs = self.window(key, 1)
+        return buf[ofs]
+
+    def find(self, sub, start = 0, end = None):
+        if end is None or end > self.size:
+            end = self.size
+        pos = start
+        while pos < end:
+            sed = min(pos + self.bufsize, end)
+            wlen = min(sed + len(sub) - 1, end) - pos
+            buf, ofs = self.window(pos, wlen)
+            r = buf.find(sub, ofs, ofs + wlen)
+            if r >= 0:
+                return r - ofs + pos
+            pos = sed
+        return -1
+
+class c_reader:
+
+    def __init__(self, raw, offset = 0, bufsize = 0x10000):
+        self.bufsize = bufsize
+        self.raw = raw
+        self.pos = offset
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @raw.setter
+    def raw(self, raw):
+        if isinstance(raw, c_data):
+            raw = raw.buffer()
+        elif hasattr(raw, 'read'):
+            try:
+                memoryview(raw)
+            except TypeError:
+                raw = c_file_raw(raw, self.bufsize)
+        self._raw = raw
+
+    def window(self, offset, length):
+        if isinstance(self._raw, c_file_raw):
+            return self._raw.window(offset, length)
+        return self._raw, offset
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def skip(self, length):
+        self.pos += length
+
+    def eof(self):
+        return self.pos >= len(self._raw)
+
+    def read(self, length):
+        buf = self._raw[self.pos: self.pos + length]
+        self.pos += length
+        return buf
+
+    def peek(self, length):
+        return self._raw[self.pos: self.pos + length]
+
+    def patch(self, offset, buf):
+        raw = self._raw
+        if isinstance(raw, c_file_raw) or (
+            not isinstance(raw, bytearray) and memoryview(raw).readonly):
+            raw = bytearray(raw[:])
+            self._raw = raw
+        raw[offset: offset + len(buf)] = buf
+
+    def find(self, sub, start = None, end = None):
+        raw = self._raw
+        if start is None:
+            start = self.pos
+        if end is None:
+            end = len(raw)
+        if hasattr(raw, 'find'):
+            return raw.find(sub, start, end)
+        r = bytes(raw[start:end]).find(sub)
+        if r >= 0:
+            r += start
+        return r
+
+    def pack_at(self, desc, offset, lazy = True):
+        raw, ofs = self.window(offset, len(desc))
+        return data_view(desc, raw, ofs, lazy)
+
+    def peek_pack(self, desc, lazy = True):
+        if self.eof():
+            return None
+        return self.pack_at(desc, self.pos, lazy)
+
+    def read_pack(self, desc, lazy = True):
+        if self.eof():
+            return None
+        spos = self.pos
+        self.pos += len(desc)
+        return self.pack_at(desc, spos, lazy)
+
 def show(data, *args, **kargs):
     pprint(data.show(*args, **kargs))
 